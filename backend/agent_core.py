@@ -1,44 +1,145 @@
 
 # backend/agent_core.py
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
 import json
+import orjson
+import numpy as np
 import time
+import random
 import re
 import os
 import sys
 import threading
 import uuid
 import hashlib
-import io
-import contextlib
-from collections import deque
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
 from datetime import datetime
 
-from config import GEMINI_API_KEY
+from config import get_gemini_api_key
+from code_executor.executor import CodeExecutor, serialize_expected_outputs
 
 # --- Ensure backend root is in path to find modules ---
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__))))
 
 # --- Configuration for Gemini API ---
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent"
+GEMINI_STREAM_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:streamGenerateContent"
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+GEMINI_EMBEDDING_API_URL = f"https://generativelanguage.googleapis.com/v1beta/{GEMINI_EMBEDDING_MODEL}:embedContent"
 HEADERS = {
     "Content-Type": "application/json",
 }
-API_KEY = GEMINI_API_KEY
+API_KEY = get_gemini_api_key()
+
+# Shared session so retries and successive attempts reuse pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake per request. Connection errors and
+# retryable statuses are retried by urllib3 with jittered backoff, honoring Retry-After.
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(
+    total=5,
+    backoff_factor=1,
+    backoff_jitter=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods={"POST"},
+)))
+_SESSION.headers.update(HEADERS)
+# (connect, read) timeouts so a stalled connection fails into the retry loop instead of hanging a worker.
+GEMINI_TIMEOUT = (5, 60)
+# Caps concurrent Gemini requests across all solver threads; excess calls wait here
+# instead of piling onto the API and coming back as 429s.
+GEMINI_MAX_CONCURRENCY = 16
+_GEMINI_SEMAPHORE = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+# Embeddings only power the optional similar-challenge shortcut, so they get their own
+# session without transport retries and a short timeout: an unreachable endpoint costs
+# a couple of seconds at most instead of the generation session's full backoff.
+_EMBEDDING_SESSION = requests.Session()
+_EMBEDDING_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+_EMBEDDING_SESSION.headers.update(HEADERS)
+EMBEDDING_TIMEOUT = (2, 5)
+
 SOLVED_CHALLENGES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'solved_challenges')
 os.makedirs(SOLVED_CHALLENGES_DIR, exist_ok=True)
 
+# Description embeddings of solved challenges, used to reuse solutions for reworded duplicates.
+# Stored outside the *.json namespace so solved-challenge listings don't pick them up.
+EMBEDDINGS_FILE = os.path.join(SOLVED_CHALLENGES_DIR, 'embeddings.npy')
+EMBEDDING_HASHES_FILE = os.path.join(SOLVED_CHALLENGES_DIR, 'embedding_hashes.txt')
+SIMILARITY_THRESHOLD = 0.92
+
+# Number of samples requested for the first attempt of each challenge.
+FIRST_ATTEMPT_CANDIDATES = 3
+
+# Fenced blocks in Gemini responses; tolerate CRLF after the opening fence.
+_PY_BLOCK_RE = re.compile(r"```python\r?\n(.*?)```", re.DOTALL)
+_JSON_BLOCK_RE = re.compile(r"```json\r?\n(.*?)```", re.DOTALL)
+
 # --- Global state for managing challenges ---
 # This is a simple in-memory store. For a larger app, use a real database.
 challenge_store = {}
 challenge_queue = deque()
 
+# Generated code runs in-process and swaps the process-wide sys.stdout while it executes,
+# so executions from concurrent solves must not overlap.
+_EXECUTION_LOCK = threading.Lock()
+
+# Solves currently running, keyed by challenge hash, so identical concurrent
+# submissions wait on the first one instead of repeating the Gemini + test loop.
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# Challenge-entry fields kept internal to the solver and left out of status snapshots.
+_PRIVATE_CHALLENGE_KEYS = frozenset({'future', 'test_cases_json'})
+
+# Bounded pool of solver workers, so a burst of submissions queues instead of spawning a thread each.
+SOLVER_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+_SOLVER_POOL = ThreadPoolExecutor(max_workers=SOLVER_MAX_WORKERS, thread_name_prefix="challenge-solver")
+
+# Background writer for solved challenges, so disk I/O stays off the solve path.
+_SAVE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="solved-challenge-writer")
+# Embedding indexing runs on its own worker so a slow embedding call never delays a durable write.
+_EMBEDDING_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="challenge-embedder")
+
+# Every solved challenge keyed by hash, filled from disk on first listing and kept
+# current by save_solved_challenge, so listings don't rescan the directory.
+_solved_index = {"loaded": False, "entries": {}}
+_solved_index_lock = threading.Lock()
+
+# Hashes of every solved challenge on disk, built on first lookup, so a cache miss
+# for an unsolved challenge is answered without stat-ing the directory.
+_solved_hashes = set()
+_solved_hashes_loaded = False
+_solved_hashes_lock = threading.Lock()
+
+# In-memory LRU in front of the solved-challenges directory, keyed by challenge hash.
+SOLVED_CACHE_MAX_ENTRIES = 1024
+_solved_cache = OrderedDict()
+_solved_cache_lock = threading.Lock()
+_solved_cache_stats = {"hits": 0, "misses": 0}
+
+# Unit-normalized description embeddings (one row per solved challenge) and their hashes.
+_embedding_index = {"loaded": False, "hashes": [], "matrix": None}
+_embedding_index_lock = threading.Lock()
+
 # --- Utility Functions ---
-def call_gemini_api(chat_history_messages, max_retries=5, base_delay=1):
+def _json_dumps_bytes(obj, indent=False):
     """
-    Calls the Gemini API with a given chat history for conversational context.
-    Implements exponential backoff for retries.
+    Serializes `obj` to UTF-8 JSON bytes with orjson, falling back to the stdlib
+    for values orjson rejects (such as integers wider than 64 bits).
     """
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
+def _build_gemini_payload(chat_history_messages, candidate_count=1):
+    """Validates the chat history and wraps it in a Gemini request payload."""
     if not isinstance(chat_history_messages, list) or \
        not all(isinstance(m, dict) and 'role' in m and 'parts' in m for m in chat_history_messages):
         raise ValueError("chat_history_messages must be a list of dictionaries with 'role' and 'parts' keys.")
@@ -50,75 +151,252 @@ def call_gemini_api(chat_history_messages, max_retries=5, base_delay=1):
             "maxOutputTokens": 4096,
         }
     }
+    if candidate_count > 1:
+        payload["generationConfig"]["candidateCount"] = candidate_count
+    return payload
+
+def call_gemini_api(chat_history_messages, max_retries=5, base_delay=1):
+    """
+    Calls the Gemini API with a given chat history for conversational context.
+    Implements exponential backoff for retries.
+    """
+    candidates = call_gemini_api_candidates(chat_history_messages, 1, max_retries, base_delay)
+    return candidates[0] if candidates else None
+
+def _retry_delay(retry_attempt, base_delay):
+    """Jittered exponential backoff, so concurrent solves don't retry in lockstep."""
+    return base_delay * (2 ** retry_attempt) * (0.5 + random.random())
+
+def call_gemini_api_candidates(chat_history_messages, candidate_count, max_retries=5, base_delay=1):
+    """
+    Requests `candidate_count` independent samples in a single Gemini call.
+    Transport errors and retryable HTTP statuses are retried by the session's urllib3 Retry
+    policy; `max_retries` only covers malformed or unexpected response bodies.
+    Returns the list of candidate texts, or None if every attempt failed.
+    """
+    payload = _build_gemini_payload(chat_history_messages, candidate_count)
     for retry_attempt in range(max_retries):
         try:
-            response = requests.post(
-                f"{GEMINI_API_URL}?key={API_KEY}",
-                headers=HEADERS,
-                data=json.dumps(payload)
-            )
+            with _GEMINI_SEMAPHORE:
+                response = _SESSION.post(
+                    f"{GEMINI_API_URL}?key={API_KEY}",
+                    data=orjson.dumps(payload),
+                    timeout=GEMINI_TIMEOUT
+                )
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
+        except requests.exceptions.RequestException as e:
+            print(f"API request failed after transport retries: {e}")
+            return None
+        except json.JSONDecodeError:
+            print(f"Failed to decode JSON response on attempt {retry_attempt + 1}.")
+        else:
+            candidate_texts = [
+                candidate["content"]["parts"][0]["text"]
+                for candidate in result.get("candidates", [])
+                if candidate.get("content") and candidate["content"].get("parts")
+            ]
+            if candidate_texts:
+                return candidate_texts
+            # Log the full response to help with debugging unexpected formats
+            print(f"Warning: Unexpected API response structure on attempt {retry_attempt + 1}. "
+                  f"Full response: {json.dumps(result, indent=2)}")
+
+        if retry_attempt < max_retries - 1:
+            delay = _retry_delay(retry_attempt, base_delay)
+            print(f"Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+    print("Max retries reached. API call failed.")
+    return None
 
-            if result.get("candidates") and result["candidates"][0].get("content") \
-               and result["candidates"][0]["content"].get("parts"):
-                return result["candidates"][0]["content"]["parts"][0]["text"]
-            else:
-                # Log the full response to help with debugging unexpected formats
-                print(f"Warning: Unexpected API response structure on attempt {retry_attempt + 1}. "
-                      f"Full response: {json.dumps(result, indent=2)}")
-                if retry_attempt < max_retries - 1:
-                    delay = base_delay * (2 ** retry_attempt)
-                    print(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    print("Max retries reached. API call failed due to unexpected response structure.")
-                    return None
+def _has_complete_code_block(text):
+    """Returns True once `text` contains an opening ```python fence and its closing fence."""
+    return _PY_BLOCK_RE.search(text) is not None
 
+def call_gemini_api_streaming(chat_history_messages, max_retries=5, base_delay=1):
+    """
+    Streams a Gemini response via `streamGenerateContent` and stops reading as soon as
+    a complete python code block has arrived, so trailing tokens are never waited on.
+    Only interrupted streams and malformed chunks are retried here; failed requests
+    are retried by the session's urllib3 Retry policy.
+    Returns the text received so far, or None if every attempt failed.
+    """
+    payload = _build_gemini_payload(chat_history_messages)
+    for retry_attempt in range(max_retries):
+        response_text = None
+        try:
+            with _GEMINI_SEMAPHORE, _SESSION.post(
+                f"{GEMINI_STREAM_API_URL}?alt=sse&key={API_KEY}",
+                data=orjson.dumps(payload),
+                timeout=GEMINI_TIMEOUT,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                response_text = ""
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
+                    chunk = orjson.loads(line[len(b"data: "):])
+                    candidates = chunk.get("candidates") or [{}]
+                    parts = candidates[0].get("content", {}).get("parts", [])
+                    response_text += "".join(part.get("text", "") for part in parts)
+                    if _has_complete_code_block(response_text):
+                        break
+
+            if response_text:
+                return response_text
+            print(f"Warning: Empty streamed API response on attempt {retry_attempt + 1}.")
         except requests.exceptions.RequestException as e:
-            print(f"API request failed on attempt {retry_attempt + 1}: {e}")
-            if retry_attempt < max_retries - 1:
-                delay = base_delay * (2 ** retry_attempt)
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print("Max retries reached. API call failed.")
+            if response_text is None:
+                # The request itself failed; the session's Retry policy has already retried it.
+                print(f"Streaming API request failed after transport retries: {e}")
                 return None
+            print(f"Stream interrupted on attempt {retry_attempt + 1}: {e}")
         except json.JSONDecodeError:
-            print(f"Failed to decode JSON response on attempt {retry_attempt + 1}.")
-            if retry_attempt < max_retries - 1:
-                delay = base_delay * (2 ** retry_attempt)
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print("Max retries reached. API call failed.")
-                return None
+            print(f"Failed to decode streamed JSON chunk on attempt {retry_attempt + 1}.")
+
+        if retry_attempt < max_retries - 1:
+            delay = _retry_delay(retry_attempt, base_delay)
+            print(f"Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+    print("Max retries reached. Streaming API call failed.")
+    return None
+
+async def call_gemini_api_async(chat_history_messages, max_retries=5, base_delay=1):
+    """
+    Awaitable variant of `call_gemini_api` for asyncio callers.
+    The blocking request runs on a worker thread, so concurrent calls overlap their network latency.
+    """
+    return await asyncio.to_thread(call_gemini_api, chat_history_messages, max_retries, base_delay)
 
 def extract_code(response_text):
     """
     Extracts code blocks from a Markdown formatted response, including any trailing main block.
     """
-    match = re.search(r"```python\n(.*?)```", response_text, re.DOTALL)
+    match = _PY_BLOCK_RE.search(response_text)
     if match:
         return match.group(1).strip()
     return None
 
-def get_challenge_hash(challenge_description, test_cases):
-    """Generates a unique hash for a challenge based on its content."""
-    content = challenge_description + json.dumps(test_cases, sort_keys=True)
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
+def canonical_test_cases_json(test_cases):
+    """Serializes test cases once in a canonical (sorted-keys, compact) form shared by hashing and prompts."""
+    return json.dumps(test_cases, sort_keys=True, separators=(',', ':'))
+
+def get_challenge_hash(challenge_description, test_cases, test_cases_json=None):
+    """
+    Generates a unique hash for a challenge based on its content.
+    Pass `test_cases_json` from `canonical_test_cases_json` to avoid serializing the test cases again.
+    """
+    if test_cases_json is None:
+        test_cases_json = canonical_test_cases_json(test_cases)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(challenge_description.encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(test_cases_json.encode('utf-8'))
+    return digest.hexdigest()
+
+def _solved_challenge_path(challenge_hash):
+    """Returns the sharded on-disk location of a solved challenge, e.g. `ab/cd/abcd....json`."""
+    return os.path.join(SOLVED_CHALLENGES_DIR, challenge_hash[:2], challenge_hash[2:4], f"{challenge_hash}.json")
+
+def iter_solved_challenge_files():
+    """Yields the path of every solved-challenge JSON file, sharded or legacy flat."""
+    for dir_path, _, filenames in os.walk(SOLVED_CHALLENGES_DIR):
+        for filename in filenames:
+            if filename.endswith(".json"):
+                yield os.path.join(dir_path, filename)
+
+def _is_known_solved_hash(challenge_hash):
+    """Returns True if `challenge_hash` has been solved, scanning the directory only on first call."""
+    global _solved_hashes_loaded
+    with _solved_hashes_lock:
+        if not _solved_hashes_loaded:
+            _solved_hashes.update(
+                os.path.basename(file_path)[:-len(".json")] for file_path in iter_solved_challenge_files()
+            )
+            _solved_hashes_loaded = True
+        return challenge_hash in _solved_hashes
+
+def _ensure_solved_index_loaded():
+    """Reads every solved-challenge file into the index once. Caller must hold `_solved_index_lock`."""
+    if _solved_index["loaded"]:
+        return
+    for file_path in iter_solved_challenge_files():
+        filename = os.path.basename(file_path)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                _solved_index["entries"].setdefault(filename[:-len(".json")], json.load(f))
+        except json.JSONDecodeError:
+            print(f"Warning: Could not parse {filename} in solved_challenges.")
+        except Exception as e:
+            print(f"Error reading {filename}: {e}")
+    _solved_index["loaded"] = True
+
+def list_solved_challenges():
+    """Returns every solved challenge, served from the in-memory index after the first call."""
+    with _solved_index_lock:
+        _ensure_solved_index_loaded()
+        return list(_solved_index["entries"].values())
+
+def _cache_solved_challenge(challenge_hash, solution_data):
+    """Stores a solved challenge in the in-memory LRU, evicting the oldest entry when full."""
+    with _solved_cache_lock:
+        _solved_cache[challenge_hash] = solution_data
+        _solved_cache.move_to_end(challenge_hash)
+        if len(_solved_cache) > SOLVED_CACHE_MAX_ENTRIES:
+            _solved_cache.popitem(last=False)
+
+def solved_cache_info():
+    """Returns hit/miss counters and the current size of the solved-challenge LRU."""
+    with _solved_cache_lock:
+        return {**_solved_cache_stats, "size": len(_solved_cache)}
 
 def load_solved_challenge(challenge_hash):
-    """Loads a previously solved challenge from the file system."""
-    file_path = os.path.join(SOLVED_CHALLENGES_DIR, f"{challenge_hash}.json")
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
+    """Loads a previously solved challenge, serving repeat lookups from the in-memory LRU."""
+    with _solved_cache_lock:
+        solution_data = _solved_cache.get(challenge_hash)
+        if solution_data is not None:
+            _solved_cache.move_to_end(challenge_hash)
+            _solved_cache_stats["hits"] += 1
+            return solution_data
+        _solved_cache_stats["misses"] += 1
+
+    if not _is_known_solved_hash(challenge_hash):
+        return None
+
+    try:
+        with open(_solved_challenge_path(challenge_hash), 'r', encoding='utf-8') as f:
+            solution_data = json.load(f)
+    except FileNotFoundError:
+        return None
+    _cache_solved_challenge(challenge_hash, solution_data)
+    return solution_data
+
+def _write_solved_challenge(challenge_hash, solution_data):
+    """Atomically writes a solved challenge to disk."""
+    try:
+        file_path = _solved_challenge_path(challenge_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_json_dumps_bytes(solution_data, indent=True))
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        print(f"Error saving solved challenge {challenge_hash}: {e}")
+
+def _index_solved_challenge_embedding(challenge_hash, challenge_description):
+    """Background task: adds a solved challenge to the similarity index, logging any failure."""
+    try:
+        remember_challenge_embedding(challenge_hash, challenge_description)
+    except Exception as e:
+        print(f"Error indexing embedding for solved challenge {challenge_hash}: {e}")
 
 def save_solved_challenge(challenge_hash, challenge_description, test_cases, final_code, attempts_taken):
-    """Saves a successfully solved challenge to the file system."""
-    file_path = os.path.join(SOLVED_CHALLENGES_DIR, f"{challenge_hash}.json")
+    """
+    Saves a successfully solved challenge. The in-memory cache is updated immediately;
+    the disk write and embedding indexing happen on separate background threads so they
+    stay off the solve latency. Returns the Future of the disk write.
+    """
     solution_data = {
         "challenge_description": challenge_description,
         "test_cases": test_cases,
@@ -126,135 +404,205 @@ def save_solved_challenge(challenge_hash, challenge_description, test_cases, fin
         "attempts_taken": attempts_taken,
         "solved_timestamp": datetime.utcnow().isoformat() + 'Z'
     }
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(solution_data, f, indent=2)
+    _cache_solved_challenge(challenge_hash, solution_data)
+    with _solved_hashes_lock:
+        # Added even before the first scan, so a hash whose disk write is still pending isn't missed.
+        _solved_hashes.add(challenge_hash)
+    with _solved_index_lock:
+        # Stored even before the first listing loads the index: the loader uses setdefault,
+        # so an entry whose disk write is still pending isn't lost when the index is built.
+        _solved_index["entries"][challenge_hash] = solution_data
+    _EMBEDDING_POOL.submit(_index_solved_challenge_embedding, challenge_hash, challenge_description)
+    return _SAVE_POOL.submit(_write_solved_challenge, challenge_hash, solution_data)
+
+@functools.lru_cache(maxsize=256)
+def _embed_text(text):
+    """Fetches a unit-normalized Gemini embedding for `text`; raises on failure so errors aren't cached."""
+    with _GEMINI_SEMAPHORE:
+        response = _EMBEDDING_SESSION.post(
+            f"{GEMINI_EMBEDDING_API_URL}?key={API_KEY}",
+            data=orjson.dumps({"model": GEMINI_EMBEDDING_MODEL, "content": {"parts": [{"text": text}]}}),
+            timeout=EMBEDDING_TIMEOUT
+        )
+    response.raise_for_status()
+    embedding = np.asarray(orjson.loads(response.content)["embedding"]["values"], dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+def get_text_embedding(text):
+    """Returns the normalized embedding of `text`, or None if the embedding API is unavailable."""
+    try:
+        return _embed_text(text)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        print(f"Warning: Could not compute embedding: {e}")
+        return None
+
+def _ensure_embedding_index_loaded():
+    """Loads persisted embeddings on first use. Caller must hold `_embedding_index_lock`."""
+    if _embedding_index["loaded"]:
+        return
+    if os.path.exists(EMBEDDINGS_FILE) and os.path.exists(EMBEDDING_HASHES_FILE):
+        try:
+            matrix = np.load(EMBEDDINGS_FILE)
+            with open(EMBEDDING_HASHES_FILE, 'r', encoding='utf-8') as f:
+                hashes = f.read().split()
+        except Exception as e:
+            # A corrupt index only costs the similarity shortcut; never let it fail every solve.
+            print(f"Warning: Could not load embedding index: {e}; starting with an empty index.")
+        else:
+            if len(hashes) == len(matrix):
+                _embedding_index["matrix"] = matrix
+                _embedding_index["hashes"] = hashes
+            else:
+                print("Warning: Embedding index files are out of sync; starting with an empty index.")
+    _embedding_index["loaded"] = True
+
+def remember_challenge_embedding(challenge_hash, challenge_description):
+    """Adds a solved challenge's description embedding to the similarity index and persists it."""
+    embedding = get_text_embedding(challenge_description)
+    if embedding is None:
+        return
+    with _embedding_index_lock:
+        _ensure_embedding_index_loaded()
+        if challenge_hash in _embedding_index["hashes"]:
+            return
+        matrix = _embedding_index["matrix"]
+        matrix = embedding[np.newaxis, :] if matrix is None else np.vstack([matrix, embedding])
+        _embedding_index["matrix"] = matrix
+        _embedding_index["hashes"].append(challenge_hash)
+        # Written to temp files first, so a crash mid-write can't leave a truncated index behind.
+        tmp_suffix = f".{threading.get_ident()}.tmp"
+        with open(EMBEDDINGS_FILE + tmp_suffix, 'wb') as f:
+            np.save(f, matrix)
+        with open(EMBEDDING_HASHES_FILE + tmp_suffix, 'w', encoding='utf-8') as f:
+            f.write("\n".join(_embedding_index["hashes"]))
+        os.replace(EMBEDDINGS_FILE + tmp_suffix, EMBEDDINGS_FILE)
+        os.replace(EMBEDDING_HASHES_FILE + tmp_suffix, EMBEDDING_HASHES_FILE)
+
+def find_semantically_similar(challenge_description, threshold=SIMILARITY_THRESHOLD):
+    """
+    Looks for a solved challenge whose description embedding has cosine similarity
+    of at least `threshold` with this one. Returns (challenge_hash, similarity) or None.
+    """
+    embedding = get_text_embedding(challenge_description)
+    if embedding is None:
+        return None
+    with _embedding_index_lock:
+        _ensure_embedding_index_loaded()
+        matrix = _embedding_index["matrix"]
+        if matrix is None:
+            return None
+        similarities = matrix @ embedding
+        best_index = int(np.argmax(similarities))
+        best_hash = _embedding_index["hashes"][best_index]
+    best_similarity = float(similarities[best_index])
+    if best_similarity >= threshold:
+        return best_hash, best_similarity
+    return None
 
-def format_test_results_for_llm(test_results, max_detailed_failures=2):
+def format_test_results_for_llm(test_results, max_detailed_failures=2, failing_tests=None, error_message=None):
     """
     Formats the test results into a readable string for the LLM,
     limiting detailed output to the first `max_detailed_failures` failing tests.
+    Pass the executor's precomputed `failing_tests` to skip re-filtering `test_results`,
+    and its `error_message` so code rejected before any test ran isn't reported as passing.
     """
-    formatted_results = []
-    failing_tests = [result for result in test_results if result["passed"] is False]
-
-    if not failing_tests:
+    if failing_tests is None:
+        failing_tests = (result for result in test_results if result["passed"] is False)
+    failing_iter = iter(failing_tests)
+    detailed_failures = list(itertools.islice(failing_iter, max_detailed_failures))
+    remaining_failures = sum(1 for _ in failing_iter)
+
+    if not detailed_failures and not remaining_failures:
+        if not test_results and error_message:
+            return f"The code failed before any test could run:\n  Error: {error_message}"
         return "All provided tests passed."
 
-    for i, result in enumerate(failing_tests):
-        if i < max_detailed_failures:
-            formatted_results.append(f"Test {result['test_number']} FAILED:")
-            formatted_results.append(f"  Input: {result['input']}")
-            formatted_results.append(f"  Expected: {result['expected_output']}, Actual: {result['actual_output']}")
-            if result["error"]:
-                formatted_results.append(f"  Error: {result['error']}")
-        else:
-            remaining_failures = len(failing_tests) - i
-            if remaining_failures > 0:
-                formatted_results.append(f"... {remaining_failures} more tests failed.")
-                break
+    formatted_results = [
+        f"Test {result['test_number']} FAILED:\n"
+        f"  Input: {result['input']}\n"
+        f"  Expected: {result['expected_output']}, Actual: {result['actual_output']}"
+        + (f"\n  Error: {result['error']}" if result["error"] else "")
+        for result in detailed_failures
+    ]
+    if remaining_failures:
+        formatted_results.append(f"... {remaining_failures} more tests failed.")
     return "\n".join(formatted_results)
 
 
-def in_process_execute_python_code(code, test_cases):
-    """
-    Executes Python code in the current process and captures output for testing.
-    This is suitable for serverless environments where Docker is not available.
-    """
-    report = {
-        "success": False,
-        "output": "",
-        "error_message": None,
-        "exception_type": None,
-        "test_results": []
-    }
-
-    # Redirect stdout to capture print statements
-    old_stdout = sys.stdout
-    redirected_stdout = io.StringIO()
-    sys.stdout = redirected_stdout
+# Generated code runs through the shared in-process executor in code_executor.
+_CODE_EXECUTOR = CodeExecutor()
 
-    try:
-        # Prepare the global environment for exec()
-        # This is a constrained environment to prevent malicious code, though not foolproof
-        exec_globals = {
-            '__builtins__': {
-                'print': print,
-                'len': len,
-                'list': list,
-                'dict': dict,
-                'str': str,
-                'int': int,
-                'float': float,
-                'range': range,
-                'min': min,
-                'max': max,
-                'sum': sum,
-                'sorted': sorted,
-                'reversed': reversed,
-                'set': set,
-            },
-            '__name__': '__main__',
-            '__file__': '<string>',
-        }
-        exec_locals = exec_globals.copy()
-        
-        # Execute the AI-generated code
-        exec(code, exec_globals, exec_locals)
+def in_process_execute_python_code(code, test_cases, expected_outputs_json=None):
+    """Executes generated code against the test cases in-process and returns the test report."""
+    return _CODE_EXECUTOR.execute_code(code, test_cases, expected_outputs_json)
 
-        # Look for the 'solve' function in the executed code's local scope
-        solution_func = exec_locals.get('solve')
-        if not solution_func or not callable(solution_func):
-            raise ValueError("Function 'solve' not found or is not a function.")
-        
-        all_tests_passed = True
-        for i, test_case in enumerate(test_cases):
-            test_result = {
-                "test_number": i + 1,
-                "input": test_case["input"],
-                "expected_output": test_case["expected_output"],
-                "actual_output": None,
-                "passed": False,
-                "error": None
-            }
-            
-            try:
-                test_input = test_case.get("input", [])
-                actual_output = solution_func(*test_input)
-                
-                test_result["actual_output"] = json.dumps(actual_output)
-                expected_output_json = json.dumps(test_case["expected_output"])
-                
-                if test_result["actual_output"] == expected_output_json:
-                    test_result["passed"] = True
-                else:
-                    all_tests_passed = False
-            except Exception as e:
-                test_result["error"] = str(e)
-                all_tests_passed = False
-            
-            report["test_results"].append(test_result)
-        
-        report["success"] = all_tests_passed
-        report["output"] = redirected_stdout.getvalue().strip()
-        
-    except Exception as e:
-        report["error_message"] = str(e)
-        report["exception_type"] = type(e).__name__
-    finally:
-        sys.stdout = old_stdout
-        
-    return report
+def _report_score(execution_report):
+    """Ranks execution reports: full success first, then by number of passing tests."""
+    passed_count = len(execution_report["test_results"]) - len(execution_report["failing_tests"])
+    return (execution_report["success"], passed_count)
 
 def solve_challenge_core(challenge_id):
     """
     Core logic for solving a challenge, running in a background thread.
+    Concurrent submissions of the same challenge share one solve: later
+    arrivals wait for the first and copy its outcome.
     """
     challenge_data = challenge_store[challenge_id]
+    test_cases_json = challenge_data['test_cases_json']
+    challenge_hash = challenge_data['challenge_hash']
+
+    with _in_flight_lock:
+        in_flight = _in_flight.get(challenge_hash)
+        is_leader = in_flight is None
+        if is_leader:
+            in_flight = {"done": threading.Event(), "challenge_id": challenge_id}
+            _in_flight[challenge_hash] = in_flight
+
+    if not is_leader:
+        challenge_store[challenge_id]['status'] = 'processing'
+        in_flight["done"].wait()
+        leader_data = challenge_store[in_flight["challenge_id"]]
+        challenge_store[challenge_id]['result'] = leader_data['result']
+        challenge_store[challenge_id]['status'] = leader_data['status']
+        return
+
+    try:
+        _solve_challenge(challenge_id, challenge_hash, test_cases_json)
+    except Exception as e:
+        # Record the failure before releasing waiters, so duplicates copy the error rather than 'processing'.
+        _record_solver_error(challenge_id, e)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[challenge_hash]
+        in_flight["done"].set()
+
+# Solve-loop prompt templates, built once at import; only the str.format fields vary per attempt.
+_FIRST_ATTEMPT_PROMPT = (
+    "You are an AI programming assistant. Your task is to write a complete, runnable Python script that solves a coding problem. "
+    "The script should define a function named `solve` that takes arguments as per the problem and returns the solution. "
+    "It should also include a `if __name__ == '__main__':` block that demonstrates how to read inputs, call `solve`, and print the output. "
+    "Problem: {description}\n"
+    "Test cases with inputs and expected outputs: {test_cases_json}\n"
+    "Provide ONLY the complete Python script within a python markdown block. Do NOT include any conversational text, explanations, or docstrings before or after the code block. Use only minimal, essential comments where logic is complex."
+)
+_RETRY_PROMPT = (
+    "The previous attempt's code failed. Here is the problem again:\n"
+    "Problem: {description}\n"
+    "And here is the code that failed:\n"
+    "```python\n{code}\n```\n"
+    "It failed the following tests and/or encountered errors:\n"
+    "{failures}\n"
+    "Please debug the code and provide a corrected, complete, runnable Python script. "
+    "Provide ONLY the corrected script within a python markdown block, no explanations or docstrings. Use only minimal, essential comments."
+)
+
+def _solve_challenge(challenge_id, challenge_hash, test_cases_json):
+    """Runs the cache lookup and generate/test/debug loop for a single challenge."""
+    challenge_data = challenge_store[challenge_id]
     challenge_description = challenge_data['description']
     test_cases = challenge_data['test_cases']
     max_attempts = challenge_data['max_attempts']
-    challenge_hash = get_challenge_hash(challenge_description, test_cases)
-    
+
     solved_data = load_solved_challenge(challenge_hash)
     if solved_data:
         challenge_store[challenge_id]['status'] = 'solved'
@@ -267,39 +615,67 @@ def solve_challenge_core(challenge_id):
         print(f"Challenge {challenge_id} already solved. Loaded from cache.")
         return
 
-    chat_history = deque(maxlen=3)
+    # Every execution below runs against the same tests; serialize their expected outputs once.
+    expected_outputs_json = serialize_expected_outputs(test_cases)
+
+    # A reworded version of an already-solved challenge may be answered by the same code;
+    # only accept it if it passes this challenge's own test cases.
+    try:
+        similar = find_semantically_similar(challenge_description)
+    except Exception as e:
+        print(f"Warning: Similar-challenge lookup failed for {challenge_id}: {e}")
+        similar = None
+    if similar:
+        similar_hash, similarity = similar
+        similar_data = load_solved_challenge(similar_hash)
+        if similar_data:
+            with _EXECUTION_LOCK:
+                similar_report = in_process_execute_python_code(similar_data['final_code'], test_cases, expected_outputs_json)
+            if similar_report["success"]:
+                save_solved_challenge(challenge_hash, challenge_description, test_cases, similar_data['final_code'], 0)
+                challenge_store[challenge_id]['status'] = 'solved'
+                challenge_store[challenge_id]['result'] = {
+                    'status': 'solved',
+                    'final_code': similar_data['final_code'],
+                    'attempts_taken': 0,
+                    'message': f'Reused the solution of a similar solved challenge (similarity {similarity:.2f}).'
+                }
+                print(f"Challenge {challenge_id} solved by reusing similar challenge {similar_hash}.")
+                return
+
+    # Each retry prompt restates the problem, the failing code and its failures, so every
+    # request is a single self-contained user turn rather than a growing conversation.
     last_generated_code = ""
 
     for attempt in range(1, max_attempts + 1):
         challenge_store[challenge_id]['status'] = 'processing'
         
-        current_prompt = ""
         if attempt == 1:
-            current_prompt = (
-                f"You are an AI programming assistant. Your task is to write a complete, runnable Python script that solves a coding problem. "
-                f"The script should define a function named `solve` that takes arguments as per the problem and returns the solution. "
-                f"It should also include a `if __name__ == '__main__':` block that demonstrates how to read inputs, call `solve`, and print the output. "
-                f"Problem: {challenge_description}\n"
-                f"Test cases with inputs and expected outputs: {json.dumps(test_cases)}\n"
-                f"Provide ONLY the complete Python script within a python markdown block. Do NOT include any conversational text, explanations, or docstrings before or after the code block. Use only minimal, essential comments where logic is complex."
+            current_prompt = _FIRST_ATTEMPT_PROMPT.format(
+                description=challenge_description,
+                test_cases_json=test_cases_json
             )
         else:
-            failing_tests_summary = format_test_results_for_llm(last_execution_report['test_results'])
-            current_prompt = (
-                f"The previous attempt's code failed. Here is the problem again:\n"
-                f"Problem: {challenge_description}\n"
-                f"And here is the code that failed:\n"
-                f"```python\n{last_generated_code}\n```\n"
-                f"It failed the following tests and/or encountered errors:\n"
-                f"{failing_tests_summary}\n"
-                f"Please debug the code and provide a corrected, complete, runnable Python script. "
-                f"Provide ONLY the corrected script within a python markdown block, no explanations or docstrings. Use only minimal, essential comments."
+            failing_tests_summary = format_test_results_for_llm(
+                last_execution_report['test_results'],
+                failing_tests=last_execution_report['failing_tests'],
+                error_message=last_execution_report['error_message']
+            )
+            current_prompt = _RETRY_PROMPT.format(
+                description=challenge_description,
+                code=last_generated_code,
+                failures=failing_tests_summary
             )
 
-        chat_history.append({"role": "user", "parts": [{"text": current_prompt}]})
-        gemini_response = call_gemini_api(list(chat_history))
+        messages = [{"role": "user", "parts": [{"text": current_prompt}]}]
+        if attempt == 1:
+            # Sample several solutions up front; any one passing saves a full round-trip.
+            gemini_responses = call_gemini_api_candidates(messages, FIRST_ATTEMPT_CANDIDATES)
+        else:
+            gemini_response = call_gemini_api_streaming(messages)
+            gemini_responses = [gemini_response] if gemini_response else None
 
-        if not gemini_response:
+        if not gemini_responses:
             challenge_store[challenge_id]['status'] = 'error'
             challenge_store[challenge_id]['result'] = {
                 'status': 'error',
@@ -307,10 +683,23 @@ def solve_challenge_core(challenge_id):
             }
             return
 
-        chat_history.append({"role": "model", "parts": [{"text": gemini_response}]})
-        last_generated_code = extract_code(gemini_response)
+        # Keep the best-scoring candidate as the code the next attempt debugs.
+        # Sampled candidates often repeat verbatim; identical code is only executed once.
+        best_candidate = None
+        evaluated_code = set()
+        for gemini_response in gemini_responses:
+            generated_code = extract_code(gemini_response)
+            if not generated_code or generated_code in evaluated_code:
+                continue
+            evaluated_code.add(generated_code)
+            with _EXECUTION_LOCK:
+                candidate_report = in_process_execute_python_code(generated_code, test_cases, expected_outputs_json)
+            if best_candidate is None or _report_score(candidate_report) > _report_score(best_candidate[1]):
+                best_candidate = (generated_code, candidate_report)
+            if candidate_report["success"]:
+                break
 
-        if not last_generated_code:
+        if best_candidate is None:
             challenge_store[challenge_id]['status'] = 'error'
             challenge_store[challenge_id]['result'] = {
                 'status': 'error',
@@ -318,7 +707,7 @@ def solve_challenge_core(challenge_id):
             }
             return
 
-        execution_report = in_process_execute_python_code(last_generated_code, test_cases)
+        last_generated_code, execution_report = best_candidate
         last_execution_report = execution_report
 
         if execution_report["success"]:
@@ -340,82 +729,142 @@ def solve_challenge_core(challenge_id):
                 'last_code': last_generated_code,
                 'attempts_taken': attempt,
                 'message': f"Max attempts ({max_attempts}) reached. Could not solve the challenge.",
-                'error_details': execution_report
+                # `failing_tests` only repeats entries of `test_results`; keep it out of the public report.
+                'error_details': {key: value for key, value in execution_report.items() if key != 'failing_tests'}
             }
             return
 
-def submit_challenge(payload):
+def register_challenge(payload):
     """
-    Accepts a challenge from the frontend and starts a background thread to solve it.
+    Creates a new entry in the challenge store and returns its ID.
+    The challenge hash is computed here, once; callers that already hold it may pass
+    `challenge_hash` (and `test_cases_json`) in the payload to skip recomputing them.
     """
     challenge_id = f"challenge_{uuid.uuid4()}"
+    description = payload.get('description') or payload.get('raw_input', 'N/A')
+    test_cases = payload.get('test_cases', [])
+    test_cases_json = payload.get('test_cases_json') or canonical_test_cases_json(test_cases)
     challenge_store[challenge_id] = {
         'id': challenge_id,
         'status': 'submitted',
-        'description': payload.get('description') or payload.get('raw_input', 'N/A'),
-        'test_cases': payload.get('test_cases', []),
+        'description': description,
+        'test_cases': test_cases,
+        'test_cases_json': test_cases_json,
+        'challenge_hash': payload.get('challenge_hash') or get_challenge_hash(description, test_cases, test_cases_json),
         'max_attempts': payload.get('max_attempts', 5),
         'result': None
     }
+    return challenge_id
 
-    thread = threading.Thread(target=solve_challenge_core, args=(challenge_id,))
-    thread.daemon = True
-    thread.start()
+def _record_solver_error(challenge_id, error):
+    """Stores an unexpected solver exception as the challenge's error result."""
+    print(f"Error in solver task {challenge_id}: {error}")
+    challenge_store[challenge_id]['status'] = 'error'
+    challenge_store[challenge_id]['result'] = {'status': 'error', 'message': str(error)}
+
+def _run_solver(challenge_id):
+    """Pool entry point: solves the challenge and records any unexpected exception as an error result."""
+    try:
+        solve_challenge_core(challenge_id)
+    except Exception as e:
+        _record_solver_error(challenge_id, e)
 
+def submit_challenge(payload):
+    """
+    Accepts a challenge from the frontend and queues it on the solver pool.
+    The pool's Future is kept on the challenge entry under 'future'.
+    """
+    challenge_id = register_challenge(payload)
+    challenge_store[challenge_id]['future'] = _SOLVER_POOL.submit(_run_solver, challenge_id)
     return challenge_id
 
+def get_challenge_snapshot(challenge_id):
+    """Returns a JSON-serializable copy of a challenge entry (without its Future), or None if unknown."""
+    challenge_data = challenge_store.get(challenge_id)
+    if challenge_data is None:
+        return None
+    return {key: value for key, value in challenge_data.items() if key not in _PRIVATE_CHALLENGE_KEYS}
+
+async def solve_challenge_core_async(challenge_id):
+    """
+    Solves a challenge on a worker thread and returns its result. Unexpected exceptions
+    are recorded as an error result rather than raised, so one failure can't sink a batch.
+    """
+    await asyncio.to_thread(_run_solver, challenge_id)
+    return challenge_store[challenge_id]['result']
+
+def solve_challenges_batch(payloads):
+    """
+    Solves many challenges concurrently so their Gemini round-trips overlap.
+    Blocks until every challenge finishes and returns a dict of challenge_id -> result.
+    Must not be called from inside a running event loop.
+    """
+    challenge_ids = [register_challenge(payload) for payload in payloads]
+
+    async def _solve_all():
+        return await asyncio.gather(*(solve_challenge_core_async(cid) for cid in challenge_ids))
+
+    results = asyncio.run(_solve_all())
+    return dict(zip(challenge_ids, results))
+
+# Static parts of the challenge-parsing prompt, built once at import; only the user input varies per call.
+_PARSE_PROMPT_PREFIX = (
+    "You are a helpful assistant designed to parse coding challenge descriptions and extract relevant information into a structured JSON format. "
+    "I will provide a coding challenge in natural language, and you should output a JSON object with two top-level keys: 'description' (string) and 'test_cases' (array of objects). "
+    "Each object in 'test_cases' should have an 'input' key (which should be an array even if it's a single argument, e.g., for `f(x)` the input `5` becomes `[5]`, for `f(x, y)` the inputs `1, 2` become `[1, 2]`) and an 'expected_output' key. "
+    "The output should ONLY be the JSON object, without any conversational text or markdown code blocks around it.\n\n"
+    "Example 1:\n"
+    "User Input:\n"
+    "Problem: Write a Python function `add` that takes two numbers and returns their sum.\n"
+    "Test cases:\n"
+    "1. Input: 1, 2. Output: 3\n"
+    "2. Input: -5, 10. Output: 5\n\n"
+    "Your JSON output:\n"
+    "```json\n"
+    "{\n"
+    "  \"description\": \"Write a Python function `add` that takes two numbers and returns their sum.\",\n"
+    "  \"test_cases\": [\n"
+    "    {\"input\": [1, 2], \"expected_output\": 3},\n"
+    "    {\"input\": [-5, 10], \"expected_output\": 5}\n"
+    "  ]\n"
+    "}\n"
+    "```\n\n"
+    "Example 2:\n"
+    "User Input:\n"
+    "Problem: Implement a function `is_palindrome` that checks if a string is a palindrome.\n"
+    "Test cases:\n"
+    "- 'madam' should return true\n"
+    "- 'hello' should return false\n\n"
+    "Your JSON output:\n"
+    "```json\n"
+    "{\n"
+    "  \"description\": \"Implement a function `is_palindrome` that checks if a string is a palindrome.\",\n"
+    "  \"test_cases\": [\n"
+    "    {\"input\": [\"madam\"], \"expected_output\": true},\n"
+    "    {\"input\": [\"hello\"], \"expected_output\": false}\n"
+    "  ]\n"
+    "}\n"
+    "```\n\n"
+    "Now, parse the following user input:\n"
+    "[USER_CHALLENGE_INPUT_START]\n"
+)
+_PARSE_PROMPT_SUFFIX = (
+    "\n[USER_CHALLENGE_INPUT_END]\n\n"
+    "Your JSON output:"
+)
+
 def parse_human_challenge_input_with_gemini(user_raw_input):
     """
     Uses Gemini to parse a human-made challenge description and test cases
     into the structured JSON format required by the agent.
     """
-    parse_prompt = (
-        "You are a helpful assistant designed to parse coding challenge descriptions and extract relevant information into a structured JSON format. "
-        "I will provide a coding challenge in natural language, and you should output a JSON object with two top-level keys: 'description' (string) and 'test_cases' (array of objects). "
-        "Each object in 'test_cases' should have an 'input' key (which should be an array even if it's a single argument, e.g., for `f(x)` the input `5` becomes `[5]`, for `f(x, y)` the inputs `1, 2` become `[1, 2]`) and an 'expected_output' key. "
-        "The output should ONLY be the JSON object, without any conversational text or markdown code blocks around it.\n\n"
-        "Example 1:\n"
-        "User Input:\n"
-        "Problem: Write a Python function `add` that takes two numbers and returns their sum.\n"
-        "Test cases:\n"
-        "1. Input: 1, 2. Output: 3\n"
-        "2. Input: -5, 10. Output: 5\n\n"
-        "Your JSON output:\n"
-        "```json\n"
-        "{\n"
-        "  \"description\": \"Write a Python function `add` that takes two numbers and returns their sum.\",\n"
-        "  \"test_cases\": [\n"
-        "    {\"input\": [1, 2], \"expected_output\": 3},\n"
-        "    {\"input\": [-5, 10], \"expected_output\": 5}\n"
-        "  ]\n"
-        "}\n"
-        "```\n\n"
-        "Example 2:\n"
-        "User Input:\n"
-        "Problem: Implement a function `is_palindrome` that checks if a string is a palindrome.\n"
-        "Test cases:\n"
-        "- 'madam' should return true\n"
-        "- 'hello' should return false\n\n"
-        "Your JSON output:\n"
-        "```json\n"
-        "{\n"
-        "  \"description\": \"Implement a function `is_palindrome` that checks if a string is a palindrome.\",\n"
-        "  \"test_cases\": [\n"
-        "    {\"input\": [\"madam\"], \"expected_output\": true},\n"
-        "    {\"input\": [\"hello\"], \"expected_output\": false}\n"
-        "  ]\n"
-        "}\n"
-        "```\n\n"
-        "Now, parse the following user input:\n"
-        f"[USER_CHALLENGE_INPUT_START]\n{user_raw_input}\n[USER_CHALLENGE_INPUT_END]\n\n"
-        "Your JSON output:"
-    )
+    parse_prompt = f"{_PARSE_PROMPT_PREFIX}{user_raw_input}{_PARSE_PROMPT_SUFFIX}"
 
     chat_history_for_parsing = [{"role": "user", "parts": [{"text": parse_prompt}]}]
     gemini_raw_response = call_gemini_api(chat_history_for_parsing, max_retries=3)
     
     if gemini_raw_response:
-        json_match = re.search(r"```json\n(.*?)```", gemini_raw_response, re.DOTALL)
+        json_match = _JSON_BLOCK_RE.search(gemini_raw_response)
         if json_match:
             json_str = json_match.group(1).strip()
         else:
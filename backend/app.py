@@ -1,31 +1,29 @@
 # backend/app.py
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import os
 import sys
-import json
-import threading
-import time
 
 # Add the backend directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__))))
 
 # Now import your agent's core logic and parsing functions
-from agent_core import solve_challenge_core, parse_human_challenge_input_with_gemini, get_challenge_hash, load_solved_challenge, SOLVED_CHALLENGES_DIR
+from agent_core import submit_challenge as queue_challenge, get_challenge_snapshot, parse_human_challenge_input_with_gemini, canonical_test_cases_json, get_challenge_hash, load_solved_challenge, list_solved_challenges, SOLVED_CHALLENGES_DIR
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serializes JSON responses with orjson, deferring to Flask's encoder for values orjson rejects."""
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj, **kwargs)
 
 app = Flask(__name__,
             static_folder='static',
             template_folder='templates')
-
-# A simple in-memory store for ongoing challenges.
-ongoing_challenges = {}
-challenge_id_counter = 0
-challenge_id_lock = threading.Lock()
-
-def generate_challenge_id():
-    global challenge_id_counter
-    with challenge_id_lock:
-        challenge_id_counter += 1
-        return f"challenge_{challenge_id_counter}"
+app.json = OrjsonProvider(app)
 
 @app.route('/')
 def index():
@@ -55,7 +53,8 @@ def submit_challenge():
     elif not challenge_desc or not test_cases:
         return jsonify({"error": "Missing 'description' or 'test_cases' in payload."}), 400
 
-    challenge_hash = get_challenge_hash(challenge_desc, test_cases)
+    test_cases_json = canonical_test_cases_json(test_cases)
+    challenge_hash = get_challenge_hash(challenge_desc, test_cases, test_cases_json)
     existing_solution = load_solved_challenge(challenge_hash)
 
     if existing_solution:
@@ -71,30 +70,13 @@ def submit_challenge():
             }
         }), 200
 
-    current_challenge_id = generate_challenge_id()
-    ongoing_challenges[current_challenge_id] = {
-        "status": "pending",
+    current_challenge_id = queue_challenge({
         "description": challenge_desc,
         "test_cases": test_cases,
+        "test_cases_json": test_cases_json,
         "challenge_hash": challenge_hash,
-        "max_attempts": max_attempts,
-        "result": None
-    }
-
-    def run_solver_task(challenge_id_to_track, desc, tc, attempts):
-        print(f"Starting solver task for {challenge_id_to_track}...")
-        try:
-            result = solve_challenge_core(desc, tc, attempts)
-            ongoing_challenges[challenge_id_to_track]["result"] = result
-            ongoing_challenges[challenge_id_to_track]["status"] = result["status"]
-            print(f"Solver task for {challenge_id_to_track} finished with status: {result['status']}")
-        except Exception as e:
-            print(f"Error in solver task {challenge_id_to_track}: {e}")
-            ongoing_challenges[challenge_id_to_track]["status"] = "error"
-            ongoing_challenges[challenge_id_to_track]["result"] = {"status": "error", "message": str(e)}
-
-    thread = threading.Thread(target=run_solver_task, args=(current_challenge_id, challenge_desc, test_cases, max_attempts))
-    thread.start()
+        "max_attempts": max_attempts
+    })
 
     return jsonify({
         "challenge_id": current_challenge_id,
@@ -105,7 +87,7 @@ def submit_challenge():
 
 @app.route('/challenge_status/<challenge_id>', methods=['GET'])
 def get_challenge_status(challenge_id):
-    challenge_info = ongoing_challenges.get(challenge_id)
+    challenge_info = get_challenge_snapshot(challenge_id)
     if not challenge_info:
         # Check if it's a cached solution ID
         if challenge_id.startswith("cached_"):
@@ -129,19 +111,18 @@ def get_challenge_status(challenge_id):
 
 @app.route('/solved_challenges', methods=['GET'])
 def get_all_solved_challenges():
-    solved_list = []
-    for filename in os.listdir(SOLVED_CHALLENGES_DIR):
-        if filename.endswith(".json"):
-            file_path = os.path.join(SOLVED_CHALLENGES_DIR, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    solved_list.append(data)
-            except json.JSONDecodeError:
-                print(f"Warning: Could not parse {filename} in solved_challenges.")
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
-    return jsonify(solved_list), 200
+    solved_list = list_solved_challenges()
+
+    def generate():
+        # Encode one entry at a time so large archives never sit in memory as a single JSON string.
+        yield '['
+        for i, data in enumerate(solved_list):
+            if i:
+                yield ','
+            yield app.json.dumps(data)
+        yield ']'
+
+    return Response(generate(), status=200, mimetype='application/json')
 
 
 if __name__ == '__main__':
@@ -2,6 +2,168 @@
 import sys
 import io
 import json
+import ast
+import types
+import functools
+import ctypes
+import threading
+
+# Builtins exposed to generated code, built once at import and read-only so one
+# run cannot tamper with the builtins seen by the next.
+_SANDBOX_BUILTINS = types.MappingProxyType({
+    'print': print,
+    'len': len,
+    'list': list,
+    'dict': dict,
+    'str': str,
+    'int': int,
+    'float': float,
+    'range': range,
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'sorted': sorted,
+    'reversed': reversed,
+    'set': set,
+})
+
+# Globals every execution starts from; each run gets a shallow copy.
+_EXEC_GLOBALS_TEMPLATE = {
+    '__builtins__': _SANDBOX_BUILTINS,
+    '__name__': '__main__',
+    '__file__': '<string>',
+}
+
+def _may_define_solve(tree):
+    """
+    Returns False only if nothing in the source could bind the name `solve`. Deliberately
+    over-approximates (any def, class, assignment, import alias or `global` naming it,
+    at any depth) since the post-exec lookup still catches the rest.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == 'solve':
+            return True
+        if isinstance(node, ast.Name) and node.id == 'solve' and isinstance(node.ctx, ast.Store):
+            return True
+        if isinstance(node, ast.alias) and (node.asname or node.name) == 'solve':
+            return True
+        if isinstance(node, ast.Global) and 'solve' in node.names:
+            return True
+    return False
+
+@functools.lru_cache(maxsize=128)
+def _compile_solution(code):
+    """
+    Parses, checks and compiles generated code once; re-running the same source reuses the code object.
+    Submissions that cannot work in the sandbox are rejected before any of their code runs.
+    """
+    tree = ast.parse(code, '<string>')
+    for node in tree.body:
+        # The sandbox has no __import__, so a top-level import would fail as soon as it ran.
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            raise ImportError(f"Imports are not available in the sandbox (line {node.lineno}).")
+    if not _may_define_solve(tree):
+        raise ValueError("Function 'solve' not found or is not a function.")
+    return compile(tree, '<string>', 'exec')
+
+# Most stdout a single execution may keep; anything printed beyond this is dropped.
+MAX_CAPTURED_OUTPUT_CHARS = 64 * 1024
+
+class _BoundedOutput(io.TextIOBase):
+    """Write-only stdout replacement that keeps the first `limit` characters and discards the rest."""
+
+    def __init__(self, limit=MAX_CAPTURED_OUTPUT_CHARS):
+        self._chunks = []
+        self._remaining = limit
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        written = len(text)
+        if written > self._remaining:
+            self.truncated = True
+            text = text[:self._remaining]
+        if text:
+            self._chunks.append(text)
+            self._remaining -= len(text)
+        return written
+
+    def getvalue(self):
+        output = "".join(self._chunks).strip()
+        if self.truncated:
+            output += "\n... output truncated."
+        return output
+
+# Wall-clock budget for one execution: the module body of generated code plus all of its tests.
+EXECUTION_TIMEOUT_SECONDS = 5
+
+# How often an expired execution is interrupted again, in case generated code catches the interrupt.
+_INTERRUPT_REPEAT_SECONDS = 0.1
+
+class _ExecutionInterrupt(BaseException):
+    """Raised asynchronously into a runaway execution; a BaseException so `except Exception` doesn't catch it."""
+
+class _ExecutionTimeout:
+    """
+    Context manager that interrupts the calling thread once `seconds` elapse.
+    Executions run on solver worker threads, where SIGALRM timers are unavailable, so a
+    watchdog thread injects `_ExecutionInterrupt` into the running thread instead, and keeps
+    re-injecting it until the block exits, since a bare `except:` in generated code can
+    swallow any single interrupt. It is surfaced as a TimeoutError. Code blocked inside a
+    single C call is only interrupted once that call returns.
+    """
+
+    def __init__(self, seconds):
+        self._seconds = seconds
+        self._lock = threading.Lock()
+        self._active = False
+        self._fired = False
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._active = True
+        self._stopped = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="execution-watchdog", daemon=True)
+        self._watchdog.start()
+        return self
+
+    def _set_async_exc(self, exc_type):
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self._thread_id), exc_type)
+
+    def _watch(self):
+        if self._stopped.wait(self._seconds):
+            return
+        while True:
+            with self._lock:
+                if not self._active:
+                    return
+                self._fired = True
+                self._set_async_exc(ctypes.py_object(_ExecutionInterrupt))
+            if self._stopped.wait(_INTERRUPT_REPEAT_SECONDS):
+                return
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        while True:
+            try:
+                with self._lock:
+                    self._active = False
+                    if self._fired:
+                        # Clear the interrupt if it is still pending so it cannot surface after this block.
+                        self._set_async_exc(None)
+                break
+            except _ExecutionInterrupt:
+                # The timer fired just as the block finished and the interrupt landed here; finish disarming.
+                continue
+        if self._fired:
+            raise TimeoutError(f"Execution timed out after {self._seconds} seconds.") from None
+        return False
+
+def serialize_expected_outputs(test_cases):
+    """Serializes each test's expected output once, for reuse across executions against the same tests."""
+    return [json.dumps(test_case["expected_output"]) for test_case in test_cases]
 
 class CodeExecutor:
     def __init__(self):
@@ -9,92 +171,86 @@ class CodeExecutor:
         # Docker commands are not supported here.
         pass
 
-    def execute_code(self, code, test_cases):
+    def execute_code(self, code, test_cases, expected_outputs_json=None):
         """
         Executes Python code in the current process and captures output for testing.
         This is suitable for serverless environments where Docker is not available.
+        Pass `expected_outputs_json` from `serialize_expected_outputs` when running
+        several submissions against the same test cases.
         """
         report = {
             "success": False,
             "output": "",
             "error_message": None,
             "exception_type": None,
-            "test_results": []
+            "test_results": [],
+            "failing_tests": []
         }
 
-        # Redirect stdout to capture print statements
+        # Redirect stdout to capture print statements, capped so chatty code cannot exhaust memory
         old_stdout = sys.stdout
-        redirected_stdout = io.StringIO()
+        redirected_stdout = _BoundedOutput()
         sys.stdout = redirected_stdout
 
+        current_result = None
         try:
             # Prepare a constrained environment for exec()
             # This is a basic sandbox to prevent malicious code, though not foolproof
-            exec_globals = {
-                '__builtins__': {
-                    'print': print,
-                    'len': len,
-                    'list': list,
-                    'dict': dict,
-                    'str': str,
-                    'int': int,
-                    'float': float,
-                    'range': range,
-                    'min': min,
-                    'max': max,
-                    'sum': sum,
-                    'sorted': sorted,
-                    'reversed': reversed,
-                    'set': set,
-                },
-                '__name__': '__main__',
-                '__file__': '<string>',
-            }
-            exec_locals = exec_globals.copy()
-            
-            # Execute the AI-generated code
-            exec(code, exec_globals, exec_locals)
-
-            # Look for the 'solve' function in the executed code's local scope
-            solution_func = exec_locals.get('solve')
-            if not solution_func or not callable(solution_func):
-                raise ValueError("Function 'solve' not found or is not a function.")
-            
-            all_tests_passed = True
-            for i, test_case in enumerate(test_cases):
-                test_result = {
-                    "test_number": i + 1,
-                    "input": test_case["input"],
-                    "expected_output": test_case["expected_output"],
-                    "actual_output": None,
-                    "passed": False,
-                    "error": None
-                }
-                
-                try:
-                    test_input = test_case.get("input", [])
-                    actual_output = solution_func(*test_input)
-                    
-                    test_result["actual_output"] = json.dumps(actual_output)
-                    expected_output_json = json.dumps(test_case["expected_output"])
-                    
-                    if test_result["actual_output"] == expected_output_json:
-                        test_result["passed"] = True
-                    else:
-                        all_tests_passed = False
-                except Exception as e:
-                    test_result["error"] = str(e)
-                    all_tests_passed = False
-                
-                report["test_results"].append(test_result)
-            
-            report["success"] = all_tests_passed
-            report["output"] = redirected_stdout.getvalue().strip()
-            
+            exec_globals = _EXEC_GLOBALS_TEMPLATE.copy()
+
+            # One budget covers the module body and every test, so a runaway submission
+            # holds the caller's execution lock for at most EXECUTION_TIMEOUT_SECONDS.
+            with _ExecutionTimeout(EXECUTION_TIMEOUT_SECONDS):
+                # Execute the AI-generated code with a single namespace, as a module would run
+                exec(_compile_solution(code), exec_globals)
+
+                # Look for the 'solve' function in the executed code's namespace
+                solution_func = exec_globals.get('solve')
+                if not solution_func or not callable(solution_func):
+                    raise ValueError("Function 'solve' not found or is not a function.")
+
+                for i, test_case in enumerate(test_cases):
+                    current_result = {
+                        "test_number": i + 1,
+                        "input": test_case["input"],
+                        "expected_output": test_case["expected_output"],
+                        "actual_output": None,
+                        "passed": False,
+                        "error": None
+                    }
+                    report["test_results"].append(current_result)
+
+                    try:
+                        test_input = test_case.get("input", [])
+                        actual_output = solution_func(*test_input)
+
+                        current_result["actual_output"] = json.dumps(actual_output)
+
+                        # Compare JSON strings, to handle lists/dicts/etc. consistently
+                        if expected_outputs_json is not None:
+                            expected_output_json = expected_outputs_json[i]
+                        else:
+                            expected_output_json = json.dumps(test_case["expected_output"])
+                        current_result["passed"] = current_result["actual_output"] == expected_output_json
+                    except Exception as e:
+                        current_result["error"] = str(e)
+                current_result = None
+
+            report["success"] = all(result["passed"] for result in report["test_results"])
+            report["output"] = redirected_stdout.getvalue()
+
+        except (TimeoutError, _ExecutionInterrupt) as e:
+            # The test running when the budget ran out is reported as timed out; later tests are skipped.
+            message = str(e) or f"Execution timed out after {EXECUTION_TIMEOUT_SECONDS} seconds."
+            if current_result is not None:
+                current_result["error"] = message
+            report["error_message"] = message
+            report["exception_type"] = "TimeoutError"
         except Exception as e:
             report["error_message"] = str(e)
             report["exception_type"] = type(e).__name__
         finally:
             sys.stdout = old_stdout
-            
+            report["failing_tests"] = [result for result in report["test_results"] if not result["passed"]]
+
         return report
@@ -1,14 +1,22 @@
 # ai_coding_agent/config.py
 import os
-from dotenv import load_dotenv
+import functools
 
-# Load environment variables from .env file
-load_dotenv()
+@functools.cache
+def get_gemini_api_key():
+    """
+    Returns the Gemini API key from the environment.
+    The .env file is only read when the variable isn't already set, as it is on Cloud Run.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY")
 
-# Get the Gemini API Key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-if not GEMINI_API_KEY:
-    print("Error: GEMINI_API_KEY not found in .env file or environment variables.")
-    print("Please ensure you have a .env file with GEMINI_API_KEY=YOUR_API_KEY")
-    exit(1)
+    if not api_key:
+        raise RuntimeError(
+            "GEMINI_API_KEY not found in .env file or environment variables. "
+            "Please ensure you have a .env file with GEMINI_API_KEY=YOUR_API_KEY"
+        )
+    return api_key